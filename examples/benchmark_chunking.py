@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+"""
+Compares the chunk size policies on a directory tree.
+
+Usage: benchmark_chunking.py [-i inline_threshold] <dir> [policy[:args] ...]
+
+A policy is a registered policy type, optionally followed by the arguments
+of its class after a colon, using python literals:
+
+    fixed:16384
+    log:factor=0.9,max_size=262144
+    tiered:tiers=((65536,None),(None,262144))
+
+For each policy the files are stored in a temporary store the same way as
+scan() does, and the deduplication ratio (input size / stored size), the
+number of chunks and inlined files and the throughput are reported. The
+stored size includes the inlined data. All registered policies are run with
+their default parameters if no policy is specified.
+
+"""
+
+import os
+import sys
+import ast
+import time
+import shutil
+import getopt
+import tempfile
+
+script_path = os.path.realpath(sys.argv[0])
+script_dir = os.path.dirname(script_path)
+lib_dir = os.path.join(os.path.dirname(script_dir), "lib")
+
+sys.path.append(lib_dir)
+
+import syncfs
+pjoin=os.path.join
+
+def usage(message=None):
+    if message:
+        print "Error: %s" % message
+    print "Usage: %s [-i inline_threshold] <dir> [policy[:args] ...]" % sys.argv[0]
+    print "Policies: %s" % ", ".join(syncfs.get_chunk_policy_types())
+    sys.exit(1)
+
+def parse_policy(spec):
+    """
+    Returns the policy object for a spec like "fixed:16384".
+
+    """
+    type, _, args = spec.partition(":")
+    try:
+        policy_class = syncfs.get_chunk_policy(type)
+    except KeyError:
+        raise ValueError("unknown policy: %r" % type)
+
+    try:
+        call = ast.parse("f(%s)" % args, mode="eval").body
+        posargs = [ast.literal_eval(arg) for arg in call.args]
+        kwargs = dict((kw.arg, ast.literal_eval(kw.value)) for kw in call.keywords)
+        if call.starargs or call.kwargs:
+            raise ValueError("* and ** are not supported")
+        return policy_class(*posargs, **kwargs)
+    except (SyntaxError, ValueError, TypeError), err:
+        raise ValueError("invalid arguments for %r: %s" % (type, err))
+
+def iter_files(base_dir):
+    for root, dirs, files in os.walk(base_dir):
+        for name in files:
+            path = pjoin(root, name)
+            if os.path.isfile(path) and not os.path.islink(path):
+                yield path
+
+def benchmark(paths, policy, store_kwargs):
+    output_dir = tempfile.mkdtemp(prefix="syncfs-bench-")
+    try:
+        store = syncfs.Store(output_dir, chunk_policy=policy, **store_kwargs)
+
+        input_size = 0
+        inline_size = 0
+        inlined = 0
+        chunks = 0
+        digests = set()
+
+        start = time.time()
+        for path in paths:
+            file = syncfs.File()
+            file.update_from_path(path, store)
+            input_size += file.meta.size
+            if file.data is not None:
+                inlined += 1
+                inline_size += len(file.data)
+            chunks += len(file.bitmap)
+            digests.update(file.bitmap)
+        elapsed = time.time() - start
+
+        stored_size = inline_size
+        for digest in digests:
+            stored_size += os.path.getsize(store.get_chunk_path(digest, False))
+    finally:
+        shutil.rmtree(output_dir)
+
+    return input_size, stored_size, chunks, len(digests), inlined, elapsed
+
+def main():
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "i:")
+    except getopt.GetoptError, err:
+        usage(str(err))
+
+    store_kwargs = {}
+    for opt, value in opts:
+        if opt == "-i":
+            try:
+                store_kwargs["inline_threshold"] = int(value)
+            except ValueError:
+                usage("invalid inline threshold: %r" % value)
+
+    if len(args) < 1:
+        usage()
+
+    base_dir = args[0]
+    specs = args[1:] or syncfs.get_chunk_policy_types()
+
+    policies = []
+    for spec in specs:
+        try:
+            policies.append((spec, parse_policy(spec)))
+        except ValueError, err:
+            usage(str(err))
+
+    paths = list(iter_files(base_dir))
+
+    print "%d files in %s" % (len(paths), base_dir)
+    width = max(len(spec) for spec in specs + ["policy"])
+    print "%-*s %12s %12s %8s %10s %10s %8s %10s" % (width, "policy", "input", "stored", "dedup",
+                                                     "chunks", "unique", "inlined", "MiB/s")
+
+    for spec, policy in policies:
+        input_size, stored_size, chunks, unique, inlined, elapsed = benchmark(paths, policy, store_kwargs)
+
+        if stored_size:
+            ratio = float(input_size) / stored_size
+        else:
+            ratio = 1.0
+
+        if elapsed:
+            throughput = input_size / elapsed / 2**20
+        else:
+            throughput = 0.0
+
+        print "%-*s %12d %12d %8.3f %10d %10d %8d %10.2f" % (width, spec, input_size, stored_size, ratio,
+                                                             chunks, unique, inlined, throughput)
+
+if __name__ == "__main__":
+    main()
@@ -32,7 +32,7 @@ def main():
                 status = False
             else:
                 orig = open(orig_path, "rb")
-                for chunk in store.iter_bitmap(file.bitmap):
+                for chunk in store.iter_file(file):
                     orig_data = orig.read(len(chunk))
                     if orig_data != chunk:
                         status = False
@@ -3,3 +3,9 @@
 from syncfs import *
 
 from backend import *
+
+from chunking import *
+
+from snapshot import *
+
+from watcher import *
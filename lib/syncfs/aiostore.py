@@ -0,0 +1,164 @@
+
+"""
+Asynchronous interface of the Store for asyncio based servers.
+
+The blocking Store methods are run in a thread pool of a fixed size, so the
+event loop is never blocked on chunk I/O and the number of threads doesn't
+depend on the number of clients.
+
+Needs trollius (asyncio for python 2) and futures (concurrent.futures for
+python 2), install them with "pip install trollius futures". These are
+optional, so the module is not imported by the package, use
+"import syncfs.aiostore".
+
+"""
+
+__all__ = ["AsyncStore", "ChunkReader"]
+
+import trollius as asyncio
+from trollius import From, Return
+from concurrent.futures import ThreadPoolExecutor
+
+
+class AsyncStore(object):
+    """
+    Wraps a Store, the methods are coroutines.
+
+    At most max_workers chunk reads or writes are running at the same time,
+    the others wait in the executor. Prefetch is the number of chunks read
+    ahead by the ChunkReaders.
+
+    """
+    def __init__(self, store, max_workers=4, prefetch=4, loop=None):
+        if prefetch < 1:
+            raise ValueError("prefetch must be at least 1: %r" % prefetch)
+
+        if loop is None:
+            loop = asyncio.get_event_loop()
+
+        self.store = store
+        self.prefetch = prefetch
+        self.loop = loop
+        self.executor = ThreadPoolExecutor(max_workers)
+
+    def close(self):
+        """
+        Waits for the running chunk I/O and stops the threads. Blocks, use
+        shutdown() from the event loop.
+
+        """
+        self.executor.shutdown(wait=True)
+
+    @asyncio.coroutine
+    def shutdown(self):
+        """
+        Coroutine version of close(), the waiting is done in another thread.
+
+        """
+        yield From(self.loop.run_in_executor(None, self.executor.shutdown, True))
+
+    @asyncio.coroutine
+    def _run(self, func, *args):
+        retval = yield From(self.loop.run_in_executor(self.executor, func, *args))
+        raise Return(retval)
+
+    @asyncio.coroutine
+    def read_chunk(self, digest):
+        retval = yield From(self._run(self.store.read_chunk, digest))
+        raise Return(retval)
+
+    @asyncio.coroutine
+    def store_chunk(self, chunk, digest):
+        yield From(self._run(self.store.store_chunk, chunk, digest))
+
+    @asyncio.coroutine
+    def store_file(self, path, chunk_size=None):
+        retval = yield From(self._run(self.store.store_file, path, chunk_size))
+        raise Return(retval)
+
+    def iter_bitmap(self, bitmap):
+        """
+        Returns a ChunkReader for the chunks of the bitmap.
+
+        """
+        return ChunkReader(self, bitmap)
+
+    def iter_file(self, file):
+        """
+        Returns a ChunkReader for the content of a File object, either its
+        inline data or the chunks of its bitmap.
+
+        """
+        if file.data is not None:
+            return ChunkReader(self, (), file.data)
+        else:
+            return ChunkReader(self, file.bitmap)
+
+
+class ChunkReader(object):
+    """
+    Reads the chunks of a bitmap in order, ahead of the consumer.
+
+    At most store.prefetch chunks are being read or waiting to be consumed
+    (including the one read() is waiting for), the reading stops until the
+    consumer has received a chunk.
+
+    """
+    def __init__(self, store, bitmap, data=None):
+        self.store = store
+        self._queue = asyncio.Queue(loop=store.loop)
+        self._slots = asyncio.Semaphore(store.prefetch, loop=store.loop)
+        self._done = False
+        self._task = asyncio.ensure_future(self._produce(list(bitmap), data), loop=store.loop)
+
+    @asyncio.coroutine
+    def _produce(self, digests, data):
+        if data:
+            yield From(self._slots.acquire())
+            future = asyncio.Future(loop=self.store.loop)
+            future.set_result(data)
+            self._queue.put_nowait(future)
+
+        for digest in digests:
+            # released by read() when the chunk is consumed
+            yield From(self._slots.acquire())
+            future = asyncio.ensure_future(self.store.read_chunk(digest), loop=self.store.loop)
+            self._queue.put_nowait(future)
+
+        self._queue.put_nowait(None)
+
+    @asyncio.coroutine
+    def read(self):
+        """
+        Returns the next chunk, None at the end.
+
+        """
+        if self._done:
+            raise Return(None)
+
+        future = yield From(self._queue.get())
+        if future is None:
+            self._done = True
+            raise Return(None)
+
+        try:
+            chunk = yield From(future)
+        except Exception:
+            self.close()
+            raise
+        finally:
+            self._slots.release()
+
+        raise Return(chunk)
+
+    def close(self):
+        """
+        Stops reading, the chunks not consumed yet are dropped.
+
+        """
+        self._done = True
+        self._task.cancel()
+        while not self._queue.empty():
+            future = self._queue.get_nowait()
+            if future is not None:
+                future.cancel()
@@ -1,7 +1,9 @@
 
 import hashlib
 import binascii
-import math
+import thread
+
+from chunking import LogChunkSizePolicy
 
 __all__ = ["Bitmap", "SHA1Bitmap", "Store", "add_bitmap", "get_bitmap"]
 
@@ -78,16 +80,27 @@ class Store(object):
     Implements bitmap + content store.
     Stores bitmaps and chunks.
     
+    The chunk size of the files is chosen by chunk_policy (see chunking.py),
+    LogChunkSizePolicy is used by default.
+    
+    Files not larger than inline_threshold bytes are not stored as chunks,
+    their content is kept in the File object instead (see read_inline).
+    
     """
-    def __init__(self, output_dir, bitmap_class=SHA1Bitmap):
+    def __init__(self, output_dir, bitmap_class=SHA1Bitmap, chunk_policy=None, inline_threshold=1024):
         self.output_dir = output_dir
         self.bitmap_class = bitmap_class
+        self.inline_threshold = inline_threshold
+
+        if chunk_policy is None:
+            chunk_policy = LogChunkSizePolicy()
+        self.chunk_policy = chunk_policy
         
     def store_file(self, path, chunk_size=None):
         bitmap = self.bitmap_class()
         
         if chunk_size is None:
-            chunk_size = self.calculate_chunk_size(os.path.getsize(path))
+            chunk_size = self.calculate_chunk_size(os.path.getsize(path), path)
 
         file = open(path, "rb")
         
@@ -100,6 +113,25 @@ class Store(object):
         
         return bitmap
 
+    def read_inline(self, path, size):
+        """
+        Returns the content of the file if it is small enough to be inlined,
+        None otherwise.
+        
+        """
+        if size > self.inline_threshold:
+            return None
+
+        file = open(path, "rb")
+        data = file.read(self.inline_threshold + 1)
+        file.close()
+
+        if len(data) > self.inline_threshold:
+            # file has grown since stat
+            return None
+
+        return data
+
     def store_chunk(self, chunk, digest):
         if not os.path.isdir(self.output_dir):
             raise ValueError("No such directory: %r" % self.output_dir)
@@ -107,7 +139,17 @@ class Store(object):
         hash_file = self.get_chunk_path(digest, True)
         
         if not os.path.isfile(hash_file):
-            open(hash_file, "w").write(chunk)
+            # written to a temporary file and renamed, so concurrent readers
+            # and writers of the same chunk never see a partial one
+            tmp_file = "%s.tmp-%d-%d" % (hash_file, os.getpid(), thread.get_ident())
+            file = open(tmp_file, "wb")
+            try:
+                file.write(chunk)
+                file.close()
+                os.rename(tmp_file, hash_file)
+            except:
+                os.unlink(tmp_file)
+                raise
 
     def get_chunk_path(self, digest, create_dir=True):
         hex_digest = binascii.b2a_hex(digest)
@@ -123,14 +165,22 @@ class Store(object):
         return hash_file
         
     
-    def calculate_chunk_size(self, size):
-        if size == 0:
-            return 0
-            
-        exp = int(math.log(size, 2))
-        ret_exp = int(exp*0.8)
-        return min(max(2**int(exp*0.8), 4096), 131072)
+    def calculate_chunk_size(self, size, path=None):
+        return self.chunk_policy.get_chunk_size(size, path)
+
 
+    def iter_file(self, file):
+        """
+        Yields the content of a File object, either its inline data or the
+        chunks of its bitmap.
+        
+        """
+        if file.data is not None:
+            if file.data:
+                yield file.data
+        else:
+            for chunk in self.iter_bitmap(file.bitmap):
+                yield chunk
 
     def iter_bitmap(self, bitmap):
         for digest in bitmap:
@@ -0,0 +1,232 @@
+
+"""
+Chunk size policies.
+
+A policy decides the chunk size of a file which is going to be stored by the
+Store. Small chunks give better deduplication, large chunks give less
+per-chunk overhead (number of files in the store, length of the bitmaps).
+
+Policies are registered by their type, so they can be looked up by name with
+get_chunk_policy().
+
+"""
+
+__all__ = ["ChunkSizePolicy", "FixedChunkSizePolicy", "LogChunkSizePolicy",
+           "TieredChunkSizePolicy", "ExtensionChunkSizePolicy",
+           "add_chunk_policy", "get_chunk_policy", "get_chunk_policy_types"]
+
+import os
+import math
+
+KiB = 1024
+MiB = 1024*KiB
+
+# extensions of the files which are already compressed, these are unlikely
+# to have common parts with other files
+COMPRESSED_EXTENSIONS = frozenset([".gz", ".tgz", ".bz2", ".xz", ".zst",
+                                   ".zip", ".jar", ".7z", ".rar",
+                                   ".png", ".jpg", ".jpeg", ".gif",
+                                   ".mp3", ".mp4", ".mkv", ".avi"])
+
+# magic numbers of the compressed formats, used when the extension tells
+# nothing
+COMPRESSED_MAGICS = ("\x1f\x8b", # gzip
+                     "BZh", # bzip2
+                     "\xfd7zXZ\x00", # xz
+                     "\x28\xb5\x2f\xfd", # zstd
+                     "PK\x03\x04", # zip
+                     "7z\xbc\xaf\x27\x1c", # 7z
+                     "Rar!", # rar
+                     "\x89PNG", # png
+                     "\xff\xd8\xff", # jpeg
+                     "GIF8", # gif
+                     )
+
+SNIFF_SIZE = max(len(magic) for magic in COMPRESSED_MAGICS)
+
+
+def is_compressed(path):
+    """
+    Returns True if the file looks compressed by its magic number.
+
+    """
+    try:
+        file = open(path, "rb")
+    except IOError:
+        return False
+
+    head = file.read(SNIFF_SIZE)
+    file.close()
+
+    for magic in COMPRESSED_MAGICS:
+        if head.startswith(magic):
+            return True
+
+    return False
+
+
+class ChunkSizePolicy(object):
+    """
+    Calculates the chunk size of a file.
+
+    Abstract class, needs to be inherited and calculate() needs to be
+    implemented.
+
+    """
+    def get_chunk_size(self, size, path=None):
+        """
+        Returns the chunk size for a file having size bytes. Path is the file
+        being stored, policies may look at its name or content, but it can
+        be None.
+
+        """
+        if size == 0:
+            return 0
+
+        return self.calculate(size, path)
+
+    def calculate(self, size, path):
+        raise NotImplementedError
+
+
+class FixedChunkSizePolicy(ChunkSizePolicy):
+    """
+    Uses the same chunk size for each file.
+
+    """
+    type = "fixed"
+
+    def __init__(self, chunk_size=64*KiB):
+        self.chunk_size = chunk_size
+
+    def calculate(self, size, path):
+        return self.chunk_size
+
+
+class LogChunkSizePolicy(ChunkSizePolicy):
+    """
+    Chunk size grows with the logarithm of the file size:
+    2**int(log2(size)*factor), limited to [min_size, max_size].
+
+    This is the default of the Store.
+
+    """
+    type = "log"
+
+    def __init__(self, factor=0.8, min_size=4*KiB, max_size=128*KiB):
+        self.factor = factor
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def calculate(self, size, path):
+        exp = int(math.log(size, 2))
+        ret_exp = int(exp*self.factor)
+        return min(max(2**ret_exp, self.min_size), self.max_size)
+
+
+class TieredChunkSizePolicy(ChunkSizePolicy):
+    """
+    Chooses the chunk size by the size of the file.
+
+    Tiers is a list of (max_file_size, chunk_size) tuples in increasing order,
+    max_file_size of the last one can be None to match everything. A chunk
+    size of None means that the file is stored in one chunk.
+
+    """
+    type = "tiered"
+
+    default_tiers = ((64*KiB, None),
+                     (1*MiB, 64*KiB),
+                     (64*MiB, 256*KiB),
+                     (None, 1*MiB))
+
+    def __init__(self, tiers=None):
+        if tiers is None:
+            tiers = self.default_tiers
+
+        if not tiers or tiers[-1][0] is not None:
+            raise ValueError("last tier must have None as max_file_size")
+
+        self.tiers = tuple(tiers)
+
+    def calculate(self, size, path):
+        for max_file_size, chunk_size in self.tiers:
+            if max_file_size is None or size <= max_file_size:
+                if chunk_size is None:
+                    return size
+                else:
+                    return chunk_size
+
+
+class ExtensionChunkSizePolicy(ChunkSizePolicy):
+    """
+    Chooses the policy by the extension of the file.
+
+    Extensions is a dict, keys are the lowercase extensions (with the leading
+    dot), values are policies or chunk sizes. Files with unknown extension
+    are checked for the magic number of the compressed formats if sniff is
+    True, otherwise the default policy is used.
+
+    Compressed files are stored with compressed_policy, by default in chunks
+    as large as possible as these are unlikely to share content.
+
+    """
+    type = "extension"
+
+    def __init__(self, extensions=None, default=None, compressed_policy=None, sniff=True):
+        if default is None:
+            default = TieredChunkSizePolicy()
+
+        if compressed_policy is None:
+            compressed_policy = FixedChunkSizePolicy(4*MiB)
+
+        self.default = self._as_policy(default)
+        self.compressed_policy = self._as_policy(compressed_policy)
+        self.sniff = sniff
+
+        self.extensions = {}
+        for ext in COMPRESSED_EXTENSIONS:
+            self.extensions[ext] = self.compressed_policy
+
+        if extensions is not None:
+            for ext, policy in extensions.iteritems():
+                self.extensions[ext.lower()] = self._as_policy(policy)
+
+    @staticmethod
+    def _as_policy(policy):
+        if isinstance(policy, ChunkSizePolicy):
+            return policy
+        else:
+            return FixedChunkSizePolicy(policy)
+
+    def calculate(self, size, path):
+        if path is None:
+            return self.default.get_chunk_size(size)
+
+        ext = os.path.splitext(path)[1].lower()
+        policy = self.extensions.get(ext)
+
+        if policy is None:
+            if self.sniff and is_compressed(path):
+                policy = self.compressed_policy
+            else:
+                policy = self.default
+
+        return policy.get_chunk_size(size, path)
+
+
+chunk_policies = {}
+
+def add_chunk_policy(policy_class):
+    chunk_policies[policy_class.type] = policy_class
+
+def get_chunk_policy(type):
+    return chunk_policies[type]
+
+def get_chunk_policy_types():
+    return sorted(chunk_policies)
+
+for tmp in (FixedChunkSizePolicy, LogChunkSizePolicy, TieredChunkSizePolicy, ExtensionChunkSizePolicy):
+    add_chunk_policy(tmp)
+
+del tmp
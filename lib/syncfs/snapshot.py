@@ -0,0 +1,172 @@
+
+"""
+Immutable snapshots of directory trees.
+
+A snapshot is a frozen copy of a Directory tree. Snapshots taken from the
+same SnapshotHistory share the nodes of the identical subtrees, these are
+found by their Merkle digest (see Directory.get_digest), so keeping many
+versions of a large tree which barely changed is cheap.
+
+Two snapshots can be compared with diff(), which descends only into the
+subtrees having different digests.
+
+"""
+
+__all__ = ["SnapshotFile", "SnapshotDirectory", "SnapshotHistory", "diff"]
+
+import os
+import weakref
+
+from syncfs import File, FileMeta, Directory
+from backend import get_bitmap
+
+
+class SnapshotFile(object):
+    """
+    Read-only version of a File.
+
+    Meta is a dict without the fields not covered by the digest (name and
+    atime), as the node may be shared by several files.
+
+    """
+    def __init__(self, digest, meta, bitmap, bitmap_type, data=None):
+        self.digest = digest
+        self.meta = meta
+        self.bitmap = bitmap
+        self.bitmap_type = bitmap_type
+        self.data = data
+
+    @classmethod
+    def from_file(cls, file):
+        meta = file.meta.as_dict() # copy
+        for key in File.digest_excluded:
+            meta.pop(key, None)
+
+        return cls(file.get_digest(),
+                   meta,
+                   tuple(file.bitmap), # copy
+                   getattr(file.bitmap, "type", None),
+                   file.data)
+
+    def to_file(self, name):
+        """
+        Returns a new File object with the content of the snapshot. The atime
+        is not kept by the snapshot, it's set to the mtime.
+
+        """
+        meta = FileMeta.from_dict(self.meta)
+        meta.name = name
+        meta.atime = meta.mtime
+        if self.bitmap_type is None:
+            bitmap = list(self.bitmap)
+        else:
+            bitmap = get_bitmap(self.bitmap_type)(self.bitmap)
+
+        return File(meta, bitmap, self.data)
+
+
+class SnapshotDirectory(object):
+    """
+    Read-only version of a Directory.
+
+    Entries are stored in a dict by their name, the values are SnapshotFile
+    or SnapshotDirectory objects. Nodes don't know their names or parents as
+    they can be shared between several directories and snapshots.
+
+    """
+    def __init__(self, digest, entries):
+        self.digest = digest
+        self.entries = entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def to_directory(self, name=None):
+        """
+        Returns a new Directory tree with the content of the snapshot.
+
+        """
+        retval = Directory(name)
+        for entry_name, entry in self.entries.iteritems():
+            if isinstance(entry, SnapshotDirectory):
+                retval.create(entry.to_directory(entry_name))
+            else:
+                retval.create(entry.to_file(entry_name))
+
+        return retval
+
+
+class SnapshotHistory(object):
+    """
+    Takes snapshots of Directory trees and keeps them in order.
+
+    Nodes are looked up by their digest before creating them, so the same
+    subtree is stored only once regardless of how many snapshots (or how many
+    places in one snapshot) contain it.
+
+    """
+    def __init__(self):
+        self.snapshots = []
+        self._nodes = weakref.WeakValueDictionary()
+
+    def __len__(self):
+        return len(self.snapshots)
+
+    def __getitem__(self, idx):
+        return self.snapshots[idx]
+
+    def take(self, directory):
+        """
+        Takes a snapshot of the directory, appends it to the history and
+        returns it.
+
+        """
+        snapshot = self._freeze(directory)
+        self.snapshots.append(snapshot)
+        return snapshot
+
+    def _freeze(self, entry):
+        digest = entry.get_digest()
+        node = self._nodes.get(digest)
+        if node is not None:
+            return node
+
+        if isinstance(entry, Directory):
+            entries = {}
+            for name, child in entry.entries.iteritems():
+                entries[name] = self._freeze(child)
+            node = SnapshotDirectory(digest, entries)
+        else:
+            node = SnapshotFile.from_file(entry)
+
+        self._nodes[digest] = node
+        return node
+
+
+def diff(old, new, root=""):
+    """
+    Compares two snapshots and yields the changes as (path, change) tuples,
+    where change is one of "added", "removed" or "modified".
+
+    Subtrees with the same digest are skipped without descending into them.
+
+    """
+    if old.digest == new.digest:
+        return
+
+    for name, old_entry in old.entries.iteritems():
+        path = os.path.join(root, name)
+        new_entry = new.entries.get(name)
+        if new_entry is None:
+            yield (path, "removed")
+        elif old_entry.digest == new_entry.digest:
+            continue
+        elif isinstance(old_entry, SnapshotDirectory) and isinstance(new_entry, SnapshotDirectory):
+            for change in diff(old_entry, new_entry, path):
+                yield change
+        else:
+            yield (path, "modified")
+
+    for name in new.entries:
+        if name not in old.entries:
+            yield (os.path.join(root, name), "added")
@@ -51,6 +51,9 @@ import os
 from keyword import iskeyword
 import collections
 import weakref
+import hashlib
+
+pjoin = os.path.join
 
 
 from backend import *
@@ -144,8 +147,11 @@ class File(object):
     """
     Represents a single file in the filesystem.
     
+    Content of small files is stored in data (inline), these have empty
+    bitmaps. Data is None for the files stored in chunks.
+    
     """
-    def __init__(self, meta=None, bitmap=None):
+    def __init__(self, meta=None, bitmap=None, data=None):
         if meta is None:
             self.meta = FileMeta()
         elif not isinstance(meta, FileMeta):
@@ -153,13 +159,15 @@ class File(object):
         else:
             self.meta = meta
             
-        if bitmap:
+        if bitmap is not None:
             self.bitmap = bitmap
         else:
             # FIXME - use bitmap class instead?
             self.bitmap = []
 
+        self.data = data
         self.parent = None
+        self._digest = None
         
     @classmethod
     def from_dict(cls, kwargs):
@@ -170,20 +178,27 @@ class File(object):
         stat = os.stat(path)
         meta = FileMeta(name, stat.st_mode, stat.st_uid, stat.st_gid, stat.st_mtime, stat.st_ctime, stat.st_atime, stat.st_size)
 
-        bitmap = store.store_file(path)
+        data = store.read_inline(path, stat.st_size)
+        if data is None:
+            bitmap = store.store_file(path)
+        else:
+            bitmap = store.bitmap_class()
+            bitmap.chunk_size = 0
         
         # FIXME
         meta.chunk_size = bitmap.chunk_size
         
         self.meta = meta
         self.bitmap = bitmap
+        self.data = data
+        self.invalidate()
                 
     def __eq__(self, other):
         if id(self) == id(other):
             return True
             
         if isinstance(other, File):
-            return self.meta == other.meta and self.bitmap == other.bitmap
+            return self.meta == other.meta and self.bitmap == other.bitmap and self.data == other.data
         else:
             return NotImplemented            
 
@@ -192,7 +207,7 @@ class File(object):
             return False
 
         if isinstance(other, File):
-            return self.meta != other.meta or self.bitmap != other.bitmap
+            return self.meta != other.meta or self.bitmap != other.bitmap or self.data != other.data
         else:
             return NotImplemented            
         
@@ -203,6 +218,37 @@ class File(object):
         self.meta.name=value
     
     name = property(get_name, set_name)
+
+    # meta fields not covered by the digest
+    digest_excluded = ("name", "atime")
+
+    def invalidate(self):
+        """
+        Drops the cached digest of the file and of all of its parents.
+        Needs to be called when meta or bitmap is changed in-place.
+        
+        """
+        self._digest = None
+        if self.parent is not None:
+            self.parent.invalidate()
+
+    def get_digest(self):
+        """
+        Returns the digest of the file, computed from the metadata and the
+        bitmap. The name and the atime are not part of it: the name is hashed
+        by the parent directory, so the same content has the same digest
+        wherever it is.
+        
+        """
+        if self._digest is None:
+            meta = tuple(getattr(self.meta, key) for key in self.meta.params
+                         if key not in self.digest_excluded)
+
+            # repr of a tuple is unambiguous, unlike the concatenated fields
+            fields = (meta, getattr(self.bitmap, "type", None), tuple(self.bitmap), self.data)
+            self._digest = hashlib.sha1(repr(fields)).digest()
+
+        return self._digest
                 
 
     def dump(self):
@@ -213,6 +259,9 @@ class File(object):
 
         retval["bitmap_type"] = self.bitmap.type # FIXME (default?)
 
+        if self.data is not None:
+            retval["data"] = self.data
+
         return retval
                 
     @classmethod
@@ -221,7 +270,7 @@ class File(object):
         bitmap_cls = get_bitmap(data["bitmap_type"])
         bitmap = bitmap_cls(data["bitmap"])
         
-        retval = cls(meta, bitmap)
+        retval = cls(meta, bitmap, data.get("data"))
         return retval
         
         
@@ -237,11 +286,15 @@ class Directory(object):
     def __init__(self, name=None, entries=None, parent=None):
         self.name = name
         self.parent = parent # this one is currently unused
+        self._digest = None
 
         if entries is None:
             self.entries = {}
         else:
             self.entries = entries
+            # needed to invalidate the digest of this directory
+            for entry in entries.itervalues():
+                entry.parent = self
         
         
     def create(self, file):
@@ -257,8 +310,16 @@ class Directory(object):
         
         self.entries[file.name] = file
         file.parent = self
+        self.invalidate()
         
-    def remove(self, file):
+    def remove(self, file, recursive=False):
+        """
+        Removes an entry from the directory.
+        
+        Non-empty directories are removed only if recursive is True, in this
+        case the removed directory keeps its entries.
+        
+        """
         if isinstance(file, (File, Directory)):
             filename = file.name
         elif isinstance(file, basestring):
@@ -271,15 +332,55 @@ class Directory(object):
         
         file = self.entries[filename]
         
-        if isinstance(file, Directory) and len(file) > 0:
+        if isinstance(file, Directory) and len(file) > 0 and not recursive:
             raise KeyError("Directory is not empty: %r" % file.name)
         
             
         del self.entries[file.name]
         file.parent = None
+        self.invalidate()
         
     def __len__(self):
         return len(self.entries)
+
+    def invalidate(self):
+        """
+        Drops the cached digest of the directory and of all of its parents.
+        
+        """
+        if self._digest is None:
+            # parents can't have a cached digest either
+            return
+
+        self._digest = None
+        if self.parent is not None:
+            self.parent.invalidate()
+
+    def get_digest(self):
+        """
+        Returns the Merkle digest of the directory.
+        
+        It is computed from the names and the digests of the entries, so two
+        directories have the same digest if and only if their subtrees are
+        identical. The digest is cached until the directory or one of its
+        descendants changes.
+        
+        """
+        if self._digest is None:
+            digest = hashlib.sha1()
+            for name in sorted(self.entries):
+                entry = self.entries[name]
+                if isinstance(entry, Directory):
+                    digest.update("D")
+                else:
+                    digest.update("F")
+                digest.update(name)
+                digest.update("\0")
+                digest.update(entry.get_digest())
+
+            self._digest = digest.digest()
+
+        return self._digest
         
     def get_dirs_files(self):
         """
@@ -0,0 +1,534 @@
+
+"""
+Keeps a Directory tree up to date by watching the filesystem with inotify.
+
+Linux only, inotify is used through ctypes. The events are collected and
+applied after a short quiet period (debounce), so a burst of writes to the
+same file re-chunks it only once. Renames inside the watched tree move the
+existing File or Directory objects, without reading the content again.
+
+"""
+
+__all__ = ["ChangeEvent", "Watcher"]
+
+import os
+import errno
+import select
+import struct
+import time
+import collections
+import ctypes
+import ctypes.util
+
+from syncfs import Struct, File, Directory
+
+pjoin = os.path.join
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_ONLYDIR)
+
+# struct inotify_event without the name
+EVENT_HEADER = struct.Struct("iIII")
+
+_libc = None
+
+def get_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not supported")
+
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+
+    return _libc
+
+def check_call(retval, path=None):
+    if retval < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err), path)
+
+    return retval
+
+
+class ChangeEvent(Struct):
+    """
+    Describes a change applied to the tree.
+
+    Kind is one of "created", "modified", "deleted", "moved" or "rescanned",
+    path is the absolute path of the entry, old_path is set for "moved".
+    Entry is the File or Directory object (detached one for "deleted").
+
+    """
+    params = ("kind",
+              "path",
+              "entry",
+              "old_path")
+
+
+class Watcher(object):
+    """
+    Watches a directory and applies the changes to its Directory tree.
+
+    Root is the Directory object of path, it is scanned if it's not
+    specified. Modified files are re-chunked through the store. Callback is
+    called with a ChangeEvent for each change applied.
+
+    Events are applied when no new event arrived for debounce seconds, or
+    when the oldest pending event is max_delay seconds old.
+
+    """
+    def __init__(self, path, store, root=None, ignore=None, callback=None,
+                 debounce=0.1, max_delay=1.0):
+        if not os.path.isabs(path) or not os.path.isdir(path):
+            raise ValueError("path must be absolute path and directory")
+
+        if ignore is None:
+            ignore = set()
+
+        self.path = path
+        self.store = store
+        self.ignore = ignore
+        self.callback = callback
+        self.debounce = debounce
+        self.max_delay = max_delay
+
+        self.fd = None
+        self.root = root
+        self._watches = {} # wd -> Directory
+        self._pending = collections.OrderedDict() # (Directory, name) -> None
+        self._moves = {} # cookie -> (Directory, name)
+        self._events = []
+        self._overflow = False
+        self._first_event = None
+        self._last_event = None
+        self._running = False
+
+    def start(self):
+        """
+        Starts watching. The tree is scanned after the watches are added, so
+        no change is lost in between.
+
+        """
+        if self.fd is not None:
+            raise ValueError("Watcher is already started")
+
+        libc = get_libc()
+        self.fd = check_call(libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+        if self.root is None:
+            self.root = Directory(os.path.basename(self.path))
+            self._watch(self.root)
+            self._rescan()
+            self._events = []
+        else:
+            self._add_watches(self.root)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self._watches.clear()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def run(self, timeout=1.0):
+        """
+        Processes the events until stop() is called.
+
+        """
+        self._running = True
+        while self._running:
+            self.poll(timeout)
+
+    def stop(self):
+        self._running = False
+
+    def poll(self, timeout=None):
+        """
+        Waits at most timeout seconds for events, then applies the pending
+        changes if the debounce period is over.
+
+        Returns the list of ChangeEvents applied.
+
+        """
+        wait = timeout
+        if self._has_changes():
+            wait = max(0, min(self._last_event + self.debounce,
+                              self._first_event + self.max_delay) - time.time())
+            if timeout is not None:
+                wait = min(wait, timeout)
+
+        readable, _, _ = select.select([self.fd], [], [], wait)
+        if readable:
+            self.read_events()
+
+        if self._has_changes():
+            now = time.time()
+            if (now - self._last_event >= self.debounce or
+                now - self._first_event >= self.max_delay):
+                return self.flush()
+
+        return []
+
+    def read_events(self):
+        """
+        Reads the available events from inotify. Renames are applied at once,
+        other changes are queued until flush(). A rename whose other half
+        hasn't arrived yet is kept until flush().
+
+        """
+        try:
+            buff = os.read(self.fd, 65536)
+        except OSError, err:
+            if err.errno != errno.EAGAIN:
+                raise
+            return
+
+        now = time.time()
+        if self._first_event is None:
+            self._first_event = now
+        self._last_event = now
+
+        offset = 0
+        while offset < len(buff):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(buff, offset)
+            offset += EVENT_HEADER.size
+            name = buff[offset:offset+length].rstrip("\0")
+            offset += length
+
+            if mask & IN_Q_OVERFLOW:
+                self._overflow = True
+                continue
+
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+
+            directory = self._watches.get(wd)
+            if directory is None or not name or name in self.ignore:
+                continue
+
+            if mask & IN_MOVED_FROM:
+                self._moves[cookie] = (directory, name)
+            elif mask & IN_MOVED_TO and cookie in self._moves:
+                self._move(self._moves.pop(cookie), (directory, name))
+            else:
+                self._pending[(directory, name)] = None
+
+        if not self._has_changes():
+            self._first_event = None
+            self._last_event = None
+
+    def _has_changes(self):
+        return bool(self._pending or self._moves or self._overflow or self._events)
+
+    def flush(self):
+        """
+        Applies the pending changes and calls the callback for each of them.
+
+        Returns the list of ChangeEvents.
+
+        """
+        if self._overflow:
+            self._rescan()
+        else:
+            # the other half of these moves is outside of the tree
+            for key in self._moves.itervalues():
+                self._pending[key] = None
+            self._moves.clear()
+
+            pending = self._pending
+            self._pending = collections.OrderedDict()
+            for directory, name in pending:
+                self._update(directory, name)
+
+        self._first_event = None
+        self._last_event = None
+
+        events = self._events
+        self._events = []
+        if self.callback is not None:
+            for event in events:
+                self.callback(event)
+
+        return events
+
+    def get_path(self, entry):
+        """
+        Returns the absolute path of an entry of the tree, None if it's not
+        in the tree (anymore).
+
+        """
+        names = []
+        while entry is not self.root:
+            if entry is None:
+                return None
+            names.append(entry.name)
+            entry = entry.parent
+
+        return pjoin(self.path, *reversed(names))
+
+    def _emit(self, kind, path, entry, old_path=None):
+        self._events.append(ChangeEvent(kind, path, entry, old_path))
+
+    def _watch(self, directory):
+        path = self.get_path(directory)
+        try:
+            wd = check_call(get_libc().inotify_add_watch(self.fd, path, WATCH_MASK), path)
+        except OSError, err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            # removed meanwhile, there will be an event for it
+            return
+
+        self._watches[wd] = directory
+
+    def _add_watches(self, directory):
+        self._watch(directory)
+        for entry in directory.entries.values():
+            if isinstance(entry, Directory):
+                self._add_watches(entry)
+
+    def _remove_watches(self, directory):
+        dirs = set()
+        queue = [directory]
+        while queue:
+            curr_dir = queue.pop()
+            dirs.add(id(curr_dir))
+            queue.extend(entry for entry in curr_dir.entries.values() if isinstance(entry, Directory))
+
+        for wd, watched in self._watches.items():
+            if id(watched) in dirs:
+                del self._watches[wd]
+                # fails if the directory is already removed
+                get_libc().inotify_rm_watch(self.fd, wd)
+
+    def _detach(self, directory, name):
+        """
+        Removes an entry (with its subtree) and emits a "deleted" event.
+
+        """
+        path = pjoin(self.get_path(directory), name)
+        entry = directory.entries[name]
+        directory.remove(name, recursive=True)
+        if isinstance(entry, Directory):
+            self._remove_watches(entry)
+        self._emit("deleted", path, entry)
+        return entry
+
+    def _move(self, source, target):
+        src_dir, src_name = source
+        dst_dir, dst_name = target
+
+        old_path = self.get_path(src_dir)
+        entry = src_dir.entries.get(src_name)
+        if old_path is None or entry is None:
+            self._pending[target] = None
+            return
+
+        if self.get_path(dst_dir) is None:
+            # moved into a directory which has been removed
+            self._detach(src_dir, src_name)
+            return
+
+        src_dir.remove(src_name, recursive=True)
+        if dst_name in dst_dir.entries:
+            self._detach(dst_dir, dst_name)
+
+        entry.name = dst_name
+        dst_dir.create(entry)
+
+        # pending changes follow the entry, a moved file is updated anyway as
+        # rename changes its ctime (this doesn't re-chunk it)
+        if source in self._pending:
+            del self._pending[source]
+            self._pending[target] = None
+        elif isinstance(entry, File):
+            self._pending[target] = None
+
+        self._emit("moved", self.get_path(entry), entry, pjoin(old_path, src_name))
+
+    def _update(self, directory, name):
+        dir_path = self.get_path(directory)
+        if dir_path is None:
+            # parent directory has been removed
+            return
+
+        path = pjoin(dir_path, name)
+        entry = directory.entries.get(name)
+
+        if os.path.isfile(path):
+            if isinstance(entry, File):
+                if self._update_file(entry, path):
+                    self._emit("modified", path, entry)
+                return
+
+            new_file = self._new_file(path)
+            if new_file is None:
+                return
+
+            if entry is not None:
+                self._detach(directory, name)
+
+            directory.create(new_file)
+            self._emit("created", path, new_file)
+
+        elif os.path.isdir(path):
+            if isinstance(entry, Directory):
+                return
+
+            if entry is not None:
+                self._detach(directory, name)
+
+            new_dir = Directory(name)
+            directory.create(new_dir)
+            self._watch(new_dir)
+            self._fill(new_dir, path)
+            self._emit("created", path, new_dir)
+
+        elif entry is not None:
+            self._detach(directory, name)
+
+    def _update_file(self, file, path):
+        """
+        Updates the file, the content is re-chunked only if its size or mtime
+        has changed. Returns False if nothing has changed.
+
+        """
+        try:
+            stat = os.stat(path)
+        except OSError, err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            # there will be an event for the removal
+            return False
+
+        meta = file.meta
+        if meta.size == stat.st_size and meta.mtime == stat.st_mtime:
+            if meta.ctime == stat.st_ctime:
+                return False
+
+            meta.mode = stat.st_mode
+            meta.owner = stat.st_uid
+            meta.group = stat.st_gid
+            meta.ctime = stat.st_ctime
+            meta.atime = stat.st_atime
+            file.invalidate()
+        else:
+            new_file = self._new_file(path)
+            if new_file is None:
+                return False
+            file.meta = new_file.meta
+            file.bitmap = new_file.bitmap
+            file.data = new_file.data
+            file.invalidate()
+
+        return True
+
+    def _new_file(self, path):
+        """
+        Returns a new File for path, None if it has been removed or replaced
+        meanwhile.
+
+        """
+        new_file = File()
+        try:
+            new_file.update_from_path(path, self.store)
+        except (IOError, OSError), err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR, errno.EISDIR):
+                raise
+            # there will be an event for the change
+            return None
+
+        return new_file
+
+    def _fill(self, directory, path):
+        """
+        Scans path into an empty, already watched directory.
+
+        """
+        try:
+            names = os.listdir(path)
+        except OSError, err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            # removed meanwhile, there will be an event for it
+            return
+
+        for name in names:
+            if name in self.ignore:
+                continue
+
+            full_path = pjoin(path, name)
+            if os.path.isfile(full_path):
+                new_file = self._new_file(full_path)
+                if new_file is not None:
+                    directory.create(new_file)
+            elif os.path.isdir(full_path):
+                new_dir = Directory(name)
+                directory.create(new_dir)
+                self._watch(new_dir)
+                self._fill(new_dir, full_path)
+
+    def _rescan(self):
+        """
+        Compares the whole tree with the filesystem, used when the kernel has
+        dropped events. Only the new and the changed files are read.
+
+        """
+        self._pending.clear()
+        self._moves.clear()
+        self._overflow = False
+
+        self._sync(self.root, self.path)
+        self._emit("rescanned", self.path, self.root)
+
+    def _sync(self, directory, path):
+        """
+        Updates the entries of a directory of the tree from path, recursively.
+
+        """
+        try:
+            names = set(name for name in os.listdir(path) if name not in self.ignore)
+        except OSError, err:
+            if err.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            # removed meanwhile, its parent will be updated
+            return
+
+        # the directory may have been replaced since it was watched, adding
+        # the watch again is a no-op otherwise
+        self._watch(directory)
+
+        for name in directory.entries.keys():
+            if name not in names:
+                self._detach(directory, name)
+
+        for name in sorted(names):
+            entry = directory.entries.get(name)
+            self._update(directory, name)
+            if isinstance(entry, Directory) and directory.entries.get(name) is entry:
+                self._sync(entry, pjoin(path, name))